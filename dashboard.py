@@ -4,10 +4,25 @@ import os
 import base64
 import traceback
 import pandas as pd
+import numpy as np
 import urllib
+import time
+import json
+import hashlib
+import hmac
+import threading
+import collections
+import functools
+import concurrent.futures
+import bisect
+import uuid
+import gzip
+import mimetypes
+from html import escape as html_escape
 
 import flask
 from flask import send_from_directory
+from werkzeug.utils import safe_join
 
 from dash import html
 from dash import dcc
@@ -16,9 +31,11 @@ import dash_auth
 import dash_table_experiments as dte
 
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
 from plotly.offline import plot as plotly
 import plotly.graph_objs as go
+import plotly.utils as plotly_utils
 
 # %% Setup
 
@@ -34,42 +51,283 @@ def app(users = None, title = 'Dash'):
     
     # Enable basic auth
     if not users == None:
-        auth = dash_auth.BasicAuth(app, users)
+        auth = CachedAuth(app, users)
         
     # Add local static path (in dashboard.py's folder, we expect a folder containing dashboard.css and bootstrap.min.css ...)
     def send_static(filename):
-        base   = os.path.dirname(__file__)
-        folder = os.path.join(base, 'dashboard')
         if debug:
-            print('send_static(): base "{}" and folder "{}" and filename "{}"'.format(base, folder, filename))
-        return flask.send_from_directory(folder, filename)
+            print('send_static(): folder "{}" and filename "{}"'.format(static_folder, filename))
+        return staticfile(filename)
     app.server.route('/dashboard/<path:filename>')(send_static)
     
     # Make sure we don't download anything from the web
     app.css.config.serve_locally     = True
     app.scripts.config.serve_locally = True
     
-    # Add download() function to app
-    def download(folder = './output'):
+    # Server-side dataframes shared between callbacks (see framestore())
+    app.frames = frames
+    
+    # Callback timings as prometheus text on /metrics and as a page on /diagnostics
+    app.metrics = metrics()
+    def send_metrics():
+        return flask.Response(app.metrics.text(), mimetype = 'text/plain; version=0.0.4')
+    def send_diagnostics():
+        return flask.Response(app.metrics.page(), mimetype = 'text/html')
+    app.server.route('/metrics')(send_metrics)
+    app.server.route('/diagnostics')(send_diagnostics)
+    
+    # Add sessions() function to app (new id in session() on every page load, needed for delta updates)
+    def sessions():
+        nonlocal app
+        newsession = lambda url: uuid.uuid4().hex
+        app.callback(Output('_session', 'data'), [Input('_url', 'pathname')])(newsession)
+    app.sessions = sessions
+    
+    # Add download() function to app (route is added once, calling again only changes the folder)
+    # Downloads support range requests and etags, sendfile = True hands files to the front-end server (X-Sendfile)
+    downloads = {}
+    def download(folder = './output', sendfile = False):
         nonlocal app
-        send_static = lambda filename: flask.send_from_directory(folder, filename)
-        app.server.route('/download/<path:filename>')(send_static)
+        app.server.config['USE_X_SENDFILE'] = sendfile
+        if not downloads:
+            def send_download(filename):
+                return flask.send_from_directory(downloads['folder'], filename, conditional = True)
+            app.server.route('/download/<path:filename>')(send_download)
+        downloads['folder'] = folder
     app.download = download
     
     # Add do() function to app
-    def app_do(on, set, to, using = [], init = True):
+    def app_do(on, set, to, using = [], init = True, cache = None, background = None):
         nonlocal app
-        return do(app, on, set, to, using, init)
+        return do(app, on, set, to, using, init, cache, background)
     app.do = app_do
     
+    # Add doall() function to app
+    def app_doall(on, sets, to, using = [], steps = {}, init = True):
+        nonlocal app
+        return doall(app, on, sets, to, using, steps, init)
+    app.doall = app_doall
+    
     return app
 
+# %% Frame store (named dataframes kept on the server, referenced by small keys in hidden components)
+
+def framestore(size = 1024 ** 3, spill = None):
+    """
+    size:  max bytes of dataframes kept in memory (least recently used are dropped or spilled)
+    spill: folder to spill evicted frames to as feather files (memory-mapped when read back), None: drop them
+    Use: key = frames.put(df, 'name', getsession(inputs)) ... df = frames.get(key), frames.drop(key)
+    """
+    store = collections.OrderedDict()
+    lock  = threading.Lock()
+    used  = {'bytes': 0}
+
+    def evict():
+        while used['bytes'] > size and len(store) > 1:
+            key, (df, nbytes) = store.popitem(last = False)
+            used['bytes'] -= nbytes
+            if spill is not None:
+                os.makedirs(os.path.dirname(spillpath(key)), exist_ok = True)
+                df.reset_index().to_feather(spillpath(key))
+
+    def spilldir(session):
+        return os.path.join(spill, hashlib.sha1(session.encode('utf8')).hexdigest()[:16])
+
+    def spillpath(key):
+        # one folder per session (the part before '/'), so a session's spill files can be dropped together
+        return os.path.join(spilldir(key.split('/', 1)[0]), hashlib.sha1(key.encode('utf8')).hexdigest() + '.feather')
+
+    def put(df, name, session = None):
+        key = '{}/{}'.format('' if session is None else session, name)
+        nbytes = int(df.memory_usage(index = True, deep = False).sum())
+        with lock:
+            if key in store:
+                used['bytes'] -= store.pop(key)[1]
+            store[key] = (df, nbytes)
+            used['bytes'] += nbytes
+            evict()
+        return key
+
+    def get(key, fail = None):
+        with lock:
+            if key in store:
+                store.move_to_end(key)
+                return store[key][0]
+        if spill is not None and os.path.isfile(spillpath(key)):
+            import pyarrow.feather
+            df = pyarrow.feather.read_table(spillpath(key), memory_map = True).to_pandas()
+            df = df.set_index(df.columns[0])
+            return df.rename_axis(None) if df.index.name == 'index' else df
+        return fail
+
+    def drop(key = None, session = None):
+        """Drop one key, all keys of a session or everything"""
+        with lock:
+            if key is None and session is None:
+                keys = list(store.keys())
+            elif key is None:
+                keys = [k for k in store.keys() if k.startswith(session + '/')]
+            else:
+                keys = [key]
+            for k in keys:
+                if k in store:
+                    used['bytes'] -= store.pop(k)[1]
+        if spill is None:
+            return
+        if key is not None:
+            if os.path.isfile(spillpath(key)):
+                os.remove(spillpath(key))
+            return
+        if session is not None:
+            folders = [spilldir(session)]
+        else:
+            folders = [e.path for e in os.scandir(spill) if e.is_dir()] if os.path.isdir(spill) else []
+        for folder in folders:
+            if os.path.isdir(folder):
+                for e in os.scandir(folder):
+                    if e.name.endswith('.feather'):
+                        os.remove(e.path)
+
+    put.get  = get
+    put.put  = put
+    put.drop = drop
+    put.used = lambda: used['bytes']
+    return put
+
+frames = framestore()
+
+def ownframe(inputs, key):
+    """True if store key 'key' (sent back by the browser) belongs to the session of these inputs"""
+    session = getsession(inputs)
+    return type(key) == str and key.startswith('{}/'.format('' if session is None else session))
+
+def getframe(inputs, id):
+    """Dataframe referenced by the key in contentof(id) / oncontent(id), empty if unknown or of another session"""
+    key = inputs.get(id, None)
+    return frames.get(key, pd.DataFrame()) if ownframe(inputs, key) else pd.DataFrame()
+
+# %% Static files (kept in memory with gzip/brotli variants, etags and long-lived caching of hashed urls)
+
+static_folder = os.path.join(os.path.dirname(__file__), 'dashboard')
+static_cache  = {}
+static_limit  = 8 * 1024 * 1024 # larger files are sent from disk
+
+def static_entry(filename):
+    path = safe_join(static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    mtime = os.path.getmtime(path)
+    entry = static_cache.get(filename)
+    if entry is not None and entry['mtime'] == mtime:
+        return entry
+    if os.path.getsize(path) > static_limit:
+        return {'mtime': mtime, 'body': None, 'hash': None}
+    with open(path, 'rb') as file:
+        body = file.read()
+    entry = {
+        'mtime': mtime,
+        'body': body,
+        'hash': hashlib.sha1(body).hexdigest()[:12],
+        'mimetype': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        'gzip': gzip.compress(body, 9),
+        'br': None
+    }
+    try:
+        import brotli
+        entry['br'] = brotli.compress(body)
+    except ImportError:
+        pass
+    static_cache[filename] = entry
+    return entry
+
+def staticfile(filename):
+    """Flask response for a file in the static folder"""
+    entry = static_entry(filename)
+    if entry is None:
+        flask.abort(404)
+    if entry['body'] is None:
+        return flask.send_from_directory(static_folder, filename, conditional = True)
+    request = flask.request
+    body, encoding = entry['body'], None
+    if entry['br'] is not None and 'br' in request.accept_encodings:
+        body, encoding = entry['br'], 'br'
+    elif 'gzip' in request.accept_encodings:
+        body, encoding = entry['gzip'], 'gzip'
+    response = flask.Response(body, mimetype = entry['mimetype'])
+    response.set_etag(entry['hash'] + ('-' + encoding if encoding else ''))
+    response.last_modified = entry['mtime']
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if request.args.get('v') == entry['hash']:
+        response.cache_control.public  = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request, accept_ranges = True, complete_length = len(body))
+
+def asset(filename):
+    """Content hashed url of a file in the static folder (cached by browsers until the file changes)"""
+    entry = static_entry(filename)
+    if entry is None or entry['hash'] is None:
+        return '/dashboard/' + filename
+    return '/dashboard/{}?v={}'.format(filename, entry['hash'])
+
+# %% Layout cache (static subtrees are built and serialised once per set of arguments)
+
+class Frozen(object):
+    """Prebuilt layout subtree, dash serialises the cached json instead of walking the components again"""
+    __slots__ = ('json',)
+
+    def __init__(self, component):
+        self.json = json.loads(json.dumps(component, cls = plotly_utils.PlotlyJSONEncoder))
+
+    def to_plotly_json(self):
+        return self.json
+
+layout_cache_size = 4096
+layout_primitives = (str, int, float, bool, type(None))
+
+def layoutcache(fun):
+    """Memoise a layout builder on its arguments (only when all are plain values, components are dynamic slots)"""
+    cache = {}
+    @functools.wraps(fun)
+    def cached(*args, **kwargs):
+        values = list(args) + list(kwargs.values())
+        if not all(isinstance(value, layout_primitives) for value in values):
+            return fun(*args, **kwargs)
+        key = (args, tuple(sorted(kwargs.items())))
+        frozen = cache.get(key)
+        if frozen is None:
+            if len(cache) >= layout_cache_size:
+                cache.clear()
+            frozen = cache[key] = Frozen(fun(*args, **kwargs))
+        return frozen
+    cached.cache = cache
+    return cached
+
+@layoutcache
+def stylesheets(*hrefs):
+    return html.Div(children = [html.Link(rel='stylesheet', href=href) for href in hrefs])
+
+@layoutcache
+def cardheader(title):
+    return html.Div(className = 'card-header', children = html.Strong(title)) if not title == None else ''
+
+@layoutcache
+def itemlabel(title, className = 'font-weight-bold'):
+    return html.Label(className = className, children = title) if not title == None else ''
+
+@layoutcache
+def itemnote(text):
+    return html.Small(className = 'form-text text-muted', children = text) if not text is None else ''
+
 # %% Page layout
 
 def page(title, menu, body):
     page = html.Div(className = '', children = [
-        html.Link(rel='stylesheet', href='/dashboard/bootstrap.min.css'),
-        html.Link(rel='stylesheet', href='/dashboard/dashboard.css'),
+        stylesheets(asset('bootstrap.min.css'), asset('dashboard.css')),
         head(title),
         html.Div(className = 'container-fluid mt-3', children = html.Div(className = 'row', children = [
             '' if menu == None else html.Div(className = 'col-sm-2', children = menu),
@@ -80,11 +338,12 @@ def page(title, menu, body):
     return page
 
 
+@layoutcache
 def head(title):
     return html.Nav(className = 'navbar', children = html.H3(className = 'font-weight-normal', children = title))
 
 def menu(title, content):
-    card_header = html.Div(className = 'card-header',    children = html.Strong(title)) if not title == None else ''
+    card_header = cardheader(title)
     card_body   = html.Div(className = 'card-body',      children = content)
     card        = html.Div(className = 'card menu-card', children = [ card_header, card_body ])
     col         = html.Div(className = 'd-inline-block mt-3 col-sm-12', children = card)
@@ -93,11 +352,12 @@ def menu(title, content):
 
 def menuitem(title, content):
     item = html.Div(className = 'form-group mb-0', children = [
-        html.Label(className = 'font-weight-bold', children = title) if not title == None else '',
+        itemlabel(title),
         html.Div(className = 'd-block', children = content)
     ])
     return item
 
+@layoutcache
 def menuhead(title):
     return html.Label(className = 'font-weight-bold', children = title)
 
@@ -112,7 +372,7 @@ def row(content):
 def box(title = None, width = 4, content = None):
     box = html.Div(className = 'd-inline-block mt-3 col-sm-' + str(width), children =
         html.Div(className = 'card', children = [
-            html.Div(className = 'card-header', children = html.Strong(title)) if title != None else '',
+            cardheader(title),
             html.Div(className = 'card-body',  children = content)
         ])
     )
@@ -134,9 +394,9 @@ def form(id, content = None):
 
 def formitem(label, item, note = None, width = 12):
     formitem = html.Div(className = 'form-group col-md-' + str(width), children = [
-        html.Label(className = 'form-label', children = label) if not label is None else '',
+        itemlabel(label, 'form-label'),
         html.Div(className = '', children = item),
-        html.Small(className = 'form-text text-muted', children = note) if not note is None else ''
+        itemnote(note)
     ])
     return formitem
 
@@ -163,12 +423,15 @@ def btn(id, name = None, color = 'primary', link = False, new = True):
 # Alias for compatib.
 btn2 = btn
 
+@layoutcache
 def rag_green(title):
     return html.H1(html.Span(className = 'badge badge-pill badge-success', children = title))
 
+@layoutcache
 def rag_amber(title):
     return html.H1(html.Span(className = 'badge badge-pill badge-warning', children = title))
 
+@layoutcache
 def rag_red(title):
     return html.H1(html.Span(className = 'badge badge-pill badge-danger',  children = title))
 
@@ -189,14 +452,19 @@ def table(id, layout = None):
         layout = 'table-' + layout
     return html.Div(id = id, className = layout)
 
-def make_table(df = None, format = True):
-    if format:
-        def colfmt(c):
-            if c.dtype.kind == 'M':
-                return c.apply(lambda t: t.strftime('%Y-%m-%d %H:%M'))
-            if c.dtype.kind == 'f':
-                return c.apply("{:.2f}".format)
-            return c
+# Vectorised cell formatting (one call per column instead of one per cell)
+def colfmt(c):
+    if c.dtype.kind == 'M':
+        return c.dt.strftime('%Y-%m-%d %H:%M')
+    if c.dtype.kind == 'f':
+        return pd.Series(np.char.mod('%.2f', c.values), index = c.index, name = c.name)
+    return c
+
+def make_table(df = None, format = True, inputs = None):
+    if type(df) == str:
+        # frame store key: only from the session of 'inputs' (keys come back from the browser)
+        df = frames.get(df, pd.DataFrame()) if inputs is not None and ownframe(inputs, df) else pd.DataFrame()
+    if format and len(df.columns) > 0:
         df = pd.concat([colfmt(df[c]) for c in df.columns], axis = 1)
 
     header = html.Thead(html.Tr([ html.Th(col) for col in df.columns ]))
@@ -205,6 +473,50 @@ def make_table(df = None, format = True):
     return table
 
 
+# Paged table: the dataframe stays on the server, only the visible page is sent (sort and filter server-side)
+def pagedtable(id, columns = [], layout = None):
+    """Table with page number, sort column ('-col' = descending) and filter text inputs: use with onpage(id) and make_pagedtable()"""
+    sort = [{'label': col, 'value': col} for col in columns] + [{'label': col + ' (desc)', 'value': '-' + col} for col in columns]
+    controls = html.Div(className = 'form-row', children = [
+        html.Div(className = 'col-sm-2', children = dcc.Input(id = id + '_page', type = 'number', min = 1, value = 1, className = 'form-control')),
+        html.Div(className = 'col-sm-4', children = dcc.Dropdown(id = id + '_sort', placeholder = 'Sort', options = sort)),
+        html.Div(className = 'col-sm-6', children = dcc.Input(id = id + '_filter', type = 'text', placeholder = 'Filter', debounce = True, className = 'form-control'))
+    ])
+    return html.Div(children = [controls, table(id, layout)])
+
+def onpage(id):
+    return [Input(id + '_page', 'value'), Input(id + '_sort', 'value'), Input(id + '_filter', 'value')]
+
+def pageof(id):
+    return [State(id + '_page', 'value'), State(id + '_sort', 'value'), State(id + '_filter', 'value')]
+
+def make_page(df, page = 1, size = 50, sort = None, filter = None):
+    """Filter (case-insensitive text in any column), sort and slice 'df' to one page, returns (page dataframe, number of rows, page)"""
+    if filter:
+        hits = np.zeros(len(df), dtype = bool)
+        for col in df.columns:
+            hits |= df[col].astype(str).str.contains(filter, case = False, regex = False).values
+        df = df[hits]
+    if sort:
+        col = sort.lstrip('-')
+        if col in df.columns:
+            df = df.sort_values(col, ascending = not sort.startswith('-'), kind = 'stable')
+    pages = max(1, -(-len(df) // size))
+    page  = min(max(1, int(page or 1)), pages)
+    return df.iloc[(page - 1) * size:page * size], len(df), page
+
+def make_pagedtable(df, inputs, id, size = 50, format = True):
+    """Render only the requested page of 'df' or frame store key (page, sort and filter read from inputs of onpage(id)/pageof(id))"""
+    if type(df) == str:
+        df = frames.get(df, pd.DataFrame()) if ownframe(inputs, df) else pd.DataFrame()
+    page   = inputs.get(id + '_page', 1)
+    sort   = inputs.get(id + '_sort', None)
+    filter = inputs.get(id + '_filter', None)
+    data, n, page = make_page(df, page, size, sort, filter)
+    first = (page - 1) * size
+    info  = html.Small(className = 'text-muted', children = 'rows {} - {} of {}'.format(first + 1 if n else 0, first + len(data), n))
+    return html.Div(children = [make_table(data, format), info])
+
 # %% Interactions
 
 # do(app = app, on = on | ondate | oncontent | onclick | ontick, set = setvalue | setcontent | setdate | setoptions, to = fun, using = valueof | dateof | contentof )
@@ -324,25 +636,268 @@ def getchanges(inputs):
 #change_detector({'button': 1}) # Change in 'button' ... returns list ['button']
 #change_detector({'button': 1}) # No change (empty list again)
 
-def do(app, on, set, to, using = [], init = True):
+# Callback metrics: latency and payload histograms per callback (plain counters, only ever incremented, no locks)
+seconds_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf')]
+bytes_buckets   = [10**3, 10**4, 10**5, 10**6, 10**7, float('inf')]
+
+def metrics(sample = 10):
+    """
+    sample: measure the serialised payload size of every <sample>th call only (serialising costs time too)
+    Use: record(name, seconds, output, error, changes) ... text() gives prometheus text, page() a diagnostics page
+    """
+    table = {}
+
+    def record(name, seconds, output, error, changes):
+        m = table.get(name)
+        if m is None:
+            m = table.setdefault(name, {
+                'calls': 0, 'errors': 0, 'seconds': [0] * len(seconds_buckets), 'seconds_sum': 0.0,
+                'bytes': [0] * len(bytes_buckets), 'bytes_sum': 0, 'bytes_count': 0, 'changes': {}
+            })
+        m['calls'] += 1
+        m['seconds'][bisect.bisect_left(seconds_buckets, seconds)] += 1
+        m['seconds_sum'] += seconds
+        if error:
+            m['errors'] += 1
+        elif m['calls'] % sample == 1 or sample == 1:
+            size = len(json.dumps(output, cls = plotly_utils.PlotlyJSONEncoder))
+            m['bytes'][bisect.bisect_left(bytes_buckets, size)] += 1
+            m['bytes_sum'] += size
+            m['bytes_count'] += 1
+        for key in changes:
+            m['changes'][key] = m['changes'].get(key, 0) + 1
+
+    def histogram(metric, name, buckets, counts, total):
+        lines = []
+        cumulative = 0
+        for le, count in zip(buckets, counts):
+            cumulative += count
+            lines.append('{}_bucket{{callback="{}",le="{}"}} {}'.format(metric, name, '+Inf' if le == float('inf') else le, cumulative))
+        lines.append('{}_sum{{callback="{}"}} {}'.format(metric, name, total))
+        lines.append('{}_count{{callback="{}"}} {}'.format(metric, name, cumulative))
+        return lines
+
+    def text():
+        lines = [
+            '# TYPE dash_callback_seconds histogram',
+            '# TYPE dash_callback_payload_bytes histogram',
+            '# TYPE dash_callback_errors_total counter',
+            '# TYPE dash_callback_input_changes_total counter'
+        ]
+        for name, m in list(table.items()):
+            lines += histogram('dash_callback_seconds', name, seconds_buckets, m['seconds'], m['seconds_sum'])
+            lines += histogram('dash_callback_payload_bytes', name, bytes_buckets, m['bytes'], m['bytes_sum'])
+            lines.append('dash_callback_errors_total{{callback="{}"}} {}'.format(name, m['errors']))
+            for key, count in list(m['changes'].items()):
+                lines.append('dash_callback_input_changes_total{{callback="{}",input="{}"}} {}'.format(name, key, count))
+        return '\n'.join(lines) + '\n'
+
+    def quantile(counts, q):
+        target = q * sum(counts)
+        cumulative = 0
+        for le, count in zip(seconds_buckets, counts):
+            cumulative += count
+            if cumulative >= target:
+                return le
+        return float('inf')
+
+    def page():
+        rows = []
+        for name, m in sorted(table.items(), key = lambda item: -item[1]['seconds_sum']):
+            changes = ', '.join('{} ({})'.format(k, v) for k, v in sorted(m['changes'].items(), key = lambda item: -item[1])[:3])
+            rows.append('<tr><td>{}</td><td>{}</td><td>{}</td><td>{:.1f}</td><td>&le; {}</td><td>&le; {}</td><td>{:.1f}</td><td>{}</td></tr>'.format(
+                html_escape(name), m['calls'], m['errors'], 1000 * m['seconds_sum'] / max(1, m['calls']),
+                quantile(m['seconds'], 0.5), quantile(m['seconds'], 0.95),
+                m['bytes_sum'] / max(1, m['bytes_count']) / 1000, html_escape(changes)))
+        return (
+            '<html><head><title>Diagnostics</title><link rel="stylesheet" href="' + asset('bootstrap.min.css') + '"></head>'
+            '<body class="container-fluid mt-3"><h3 class="font-weight-normal">Callbacks</h3><table class="table">'
+            '<thead><tr><th>callback</th><th>calls</th><th>errors</th><th>mean ms</th><th>p50 s</th><th>p95 s</th><th>mean kB</th><th>changed inputs</th></tr></thead>'
+            '<tbody>' + ''.join(rows) + '</tbody></table></body></html>'
+        )
+
+    record.table = table
+    record.text  = text
+    record.page  = page
+    return record
+
+# Callback result cache (LRU with optional time-to-live), shared by all sessions of a callback
+def memo(size = 128, ttl = None, tick = None):
+    """
+    size: max number of cached results (least recently used are dropped)
+    ttl:  seconds a result stays valid (None: forever)
+    tick: seconds, ontick() inputs are replaced by the current <tick> interval so all sessions share one result per interval
+    Use: do(..., cache = memo()) ... memo.invalidate() drops all results, memo.stats() returns hits/misses/size
+    """
+    store = collections.OrderedDict()
+    lock  = threading.Lock()
+    stats = {'hits': 0, 'misses': 0}
+    running = {} # key -> Future of the computation in flight, concurrent misses wait for it
+
+    def cached(key, compute):
+        now = time.time()
+        with lock:
+            if key in store and (ttl is None or now - store[key][0] < ttl):
+                store.move_to_end(key)
+                stats['hits'] += 1
+                return store[key][1]
+            mine = key not in running
+            if mine:
+                stats['misses'] += 1
+                running[key] = concurrent.futures.Future()
+            else:
+                stats['hits'] += 1
+            future = running[key]
+        if not mine:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            with lock:
+                del running[key]
+            future.set_exception(e)
+            raise
+        with lock:
+            del running[key]
+            store[key] = (now, value)
+            store.move_to_end(key)
+            while len(store) > size:
+                store.popitem(last = False)
+        future.set_result(value)
+        return value
+
+    def invalidate(key = None):
+        with lock:
+            if key is None:
+                store.clear()
+            else:
+                store.pop(key, None)
+
+    def memostats():
+        with lock:
+            return {**stats, 'size': len(store)}
+
+    def makekey(props, args, scope = None):
+        """Key of input values, <scope> (e.g. output and function) keeps callbacks sharing this memo apart"""
+        return inputkey([scope] + [int(time.time() // tick) if tick and prop == 'n_intervals' else arg for prop, arg in zip(props, args)])
+
+    cached.invalidate = invalidate
+    cached.stats      = memostats
+    cached.key        = makekey
+    return cached
+
+# Background jobs: run callbacks on a pool, coalesce identical in-flight runs and cancel superseded ones
+class JobCancelled(Exception):
+    pass
+
+def jobs(threads = 4, processes = False, placeholder = 'Loading ...', keep = 60):
+    """
+    threads:     pool size
+    processes:   True: run on a process pool ('to' must be picklable, no cache/progress)
+    placeholder: content shown while running, or function(progress) -> content (progress from inputs['_progress'](0..1))
+    keep:        seconds a finished result stays available (counted from completion, polled or not)
+    Use: do(..., background = jobs()) and put job(<id of set>) in the layout
+    """
+    pool  = concurrent.futures.ProcessPoolExecutor(threads) if processes else concurrent.futures.ThreadPoolExecutor(threads)
+    lock  = threading.Lock()
+    table = {}
+
+    def purge(now):
+        for old in [k for k, e in table.items() if e['done'] is not None and now - e['done'] > keep]:
+            del table[old]
+
+    def finished(entry):
+        return lambda future: entry.update(done = time.time())
+
+    def submit(key, fun, *args):
+        entry = {'waiting': 1, 'progress': None, 'cancelled': False, 'done': None}
+        def progress(value):
+            if entry['cancelled']:
+                raise JobCancelled()
+            entry['progress'] = value
+        with lock:
+            purge(time.time())
+            if key in table:
+                table[key]['waiting'] += 1
+                return
+            entry['future'] = pool.submit(fun, *args) if processes else pool.submit(fun, *args, progress)
+            entry['future'].add_done_callback(finished(entry))
+            table[key] = entry
+
+    def release(key):
+        with lock:
+            entry = table.get(key)
+            if entry is None:
+                return
+            entry['waiting'] -= 1
+            if entry['waiting'] <= 0:
+                entry['cancelled'] = True
+                entry['future'].cancel()
+                del table[key]
+
+    def status(key):
+        """Return (state, output) with state 'unknown', 'running' or 'done'"""
+        now = time.time()
+        with lock:
+            purge(now)
+            entry = table.get(key)
+        if entry is None:
+            return 'unknown', None
+        future = entry['future']
+        if not future.done():
+            return 'running', placeholder(entry['progress']) if callable(placeholder) else placeholder
+        error = future.exception()
+        if error is not None:
+            return 'done', ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        return 'done', future.result()
+
+    submit.release   = release
+    submit.status    = status
+    submit.processes = processes
+    return submit
+
+def job(id, interval = 500):
+    """Hidden job slot and poll clock for do(set = ...(id), background = jobs())"""
+    return html.Div(className = 'd-none', children = [
+        html.Div(id = id + '_job'),
+        dcc.Interval(id = id + '_poll', interval = interval, disabled = True)
+    ])
+
+def inputkey(values):
+    """Stable hash of callback input values"""
+    return hashlib.md5(json.dumps(values, sort_keys = True, default = str).encode('utf8')).hexdigest()
+
+def do(app, on, set, to, using = [], init = True, cache = None, background = None):
     """
     on:  on(), ons(), ontick(), onclick(), ondate(), onzoom(), onhover()
     set: setvalue(), setcontent(), setplot(), settable(), setdatatable()
     to:  <function>
     using: valueof(), dateof(), contentof()
     changes: True: enable change tracking in inputs['_changes'] otherwise False
+    cache: None, True (default memo()) or memo(size, ttl, tick): reuse results for identical input values
+           (inputs['_changes'] is not part of the key, so cached functions shouldn't depend on it)
+    background: None, True (default jobs()) or jobs(...): run 'to' on a pool, show a placeholder meanwhile
+           (needs job(id) of the set component in the layout)
     """
     names = [e.component_id       for e in on] + [e.component_id       for e in using]
     comps = [e.component_property for e in on] + [e.component_property for e in using]
     combs = ['.'.join(comb) for comb in zip(names, comps)]
     detector = changed()
     initialized = False
-    def to2(*args):
-        nonlocal initialized
+    cache = memo() if cache is True else cache
+    background = jobs() if background is True else background
+    record = getattr(app, 'metrics', None)
+    name = '+'.join(e.component_id + '.' + e.component_property for e in (set if type(set) == list else [set]))
+
+    def prepare(args):
         inputs1 = dict(zip(names, args))
         inputs2 = dict(zip(combs, args))
         inputs = {**inputs1, **inputs2}
         inputs['_changes'] = detector(inputs)
+        return inputs
+
+    def skip(inputs):
+        nonlocal initialized
         if init == False and initialized == False:
             initialized = True
             if debug:
@@ -352,58 +907,258 @@ def do(app, on, set, to, using = [], init = True):
                 print()
                 print(inputs)
                 print()
-            return None
-        else:
-            try:
+            return True
+        return False
+
+    def call(inputs, args, progress = None):
+        if progress is not None:
+            inputs['_progress'] = progress
+        error = False
+        start = time.perf_counter()
+        try:
+            if cache is None:
                 output = to(inputs)
-                if debug:
-                    print()
-                    print()
-                    print('{function}() inputs:'.format(function = to.__name__))
-                    print()
-                    print(inputs)
-                    print()
-                    print('{function}() outputs:'.format(function = to.__name__))
-                    print()
-                    print(output)
-                    print()
-            except Exception as e:
-                ex_type, ex_value, ex_traceback = sys.exc_info()
-                output = traceback.format_exc()
+            else:
+                output = cache(cache.key(comps, args, [name, to.__module__, to.__qualname__]), lambda: to(inputs))
+            if debug:
                 print()
                 print()
                 print('{function}() inputs:'.format(function = to.__name__))
                 print()
                 print(inputs)
                 print()
-                print('{function}() EXCEPTION:'.format(function = to.__name__))
+                print('{function}() outputs:'.format(function = to.__name__))
                 print()
-                print(traceback.format_exc())
+                print(output)
                 print()
+        except JobCancelled:
+            return None
+        except Exception as e:
+            ex_type, ex_value, ex_traceback = sys.exc_info()
+            error = True
+            output = traceback.format_exc()
+            print()
+            print()
+            print('{function}() inputs:'.format(function = to.__name__))
+            print()
+            print(inputs)
+            print()
+            print('{function}() EXCEPTION:'.format(function = to.__name__))
+            print()
+            print(traceback.format_exc())
+            print()
+        if record is not None:
+            record(name, time.perf_counter() - start, output, error, inputs['_changes'])
         return output
-    return app.callback(set, on, using)(to2)
+
+    def to2(*args):
+        inputs = prepare(args)
+        if skip(inputs):
+            return None
+        return call(inputs, args)
+
+    if background is None:
+        return app.callback(set, on, using)(to2)
+
+    # In background mode the hidden job slot of each browser holds the key of its latest run,
+    # fetch() alone drives the poll clock: it runs when the slot changes and on every tick
+    slot = set.component_id + '_job'
+    poll = set.component_id + '_poll'
+
+    def start(*args):
+        *args, previous = args
+        inputs = prepare(args)
+        if skip(inputs):
+            return None
+        key = inputkey([set.component_id, set.component_property] + list(args))
+        if background.processes:
+            background(key, to, inputs)
+        else:
+            background(key, call, inputs, args)
+        if previous is not None:
+            background.release(previous)
+        return key
+
+    def fetch(n, key):
+        if key is None:
+            raise PreventUpdate
+        state, output = background.status(key)
+        if state == 'unknown':
+            return dash.no_update, True
+        return output, state == 'done'
+
+    app.callback(Output(slot, 'children'), on, using + [State(slot, 'children')])(start)
+    return app.callback([set, Output(poll, 'disabled')], [Input(poll, 'n_intervals'), Input(slot, 'children')])(fetch)
+
+# Dependency graph: named steps shared by several outputs, all updated in one callback / response
+def node(fun, needs = None):
+    """Step for doall(): fun(inputs) runs again only when one of 'needs' changed (input ids, 'id.prop' or step names, None: everything)"""
+    return {'fun': fun, 'needs': needs}
+
+def doall(app, on, sets, to, using = [], steps = {}, init = True, size = 32):
+    """
+    on:    on(), ons(), ontick(), onclick(), ...
+    sets:  list of setvalue(), setcontent(), setplot(), ... outputs
+    to:    list of <function> or node(<function>, needs), one per output
+    using: valueof(), dateof(), contentof()
+    steps: dict {name: <function> or node(<function>, needs)}, run in order before the outputs, result in inputs[name]
+    size:  results kept per node
+    Steps and outputs are only recomputed when their needs changed: results are kept per node and signature of
+    its needs (memo()), so sessions with different inputs reuse their own results, functions run without a lock
+    """
+    names = [e.component_id       for e in on] + [e.component_id       for e in using]
+    comps = [e.component_property for e in on] + [e.component_property for e in using]
+    combs = ['.'.join(comb) for comb in zip(names, comps)]
+    nodes = list(steps.items()) + [('_set{}'.format(i), fun) for i, fun in enumerate(to)]
+    nodes = [(key, step if type(step) == dict else node(step)) for key, step in nodes]
+    cache = {key: memo(size) for key, step in nodes}
+    detectors = {key: changed() for key, step in nodes}
+    lock  = threading.Lock() # guards the change detectors only
+    record = getattr(app, 'metrics', None)
+    label  = '+'.join(e.component_id + '.' + e.component_property for e in sets)
+    initialized = False
+
+    def run(key, step, inputs, values):
+        with lock:
+            changes = detectors[key](values)
+        return step['fun']({**inputs, '_changes': changes})
+
+    def to2(*args):
+        nonlocal initialized
+        inputs1 = dict(zip(names, args))
+        inputs2 = dict(zip(combs, args))
+        inputs = {**inputs1, **inputs2}
+        if init == False and initialized == False:
+            initialized = True
+            return [None for e in sets]
+        start = time.perf_counter()
+        error = False
+        signatures = {}
+        for key, step in nodes:
+            # steps are represented by their own signature, so changes propagate downstream
+            needs  = step['needs'] if step['needs'] is not None else names + combs + list(signatures.keys())
+            values = {need: signatures[need] if need in signatures else inputs.get(need, None) for need in needs}
+            signatures[key] = inputkey([key, values])
+            try:
+                # errors are not memoised, the next trigger runs the step again
+                inputs[key] = cache[key](signatures[key], functools.partial(run, key, step, inputs, values))
+            except Exception as e:
+                error = True
+                inputs[key] = traceback.format_exc()
+                print()
+                print()
+                print('{function}() EXCEPTION:'.format(function = step['fun'].__name__))
+                print()
+                print(traceback.format_exc())
+                print()
+        outputs = [inputs['_set{}'.format(i)] for i in range(len(sets))]
+        if record is not None:
+            record(label, time.perf_counter() - start, outputs, error, [])
+        return outputs
+
+    return app.callback(sets, on, using)(to2)
 
 # Plotting
 
-def make_plot(df, height = 350):
-    # tz_localize(None) -> https://github.com/plotly/plotly.py/issues/209
-    lines  = [go.Scatter(x = df.index.tz_localize(None), y = df[col], name = col) for col in df.columns]
+# Downsampling: keep about <points> (~ pixel width) per line instead of sending every point to the browser
+def lttb(x, y, points):
+    """Positions of <points> samples of (x, y) picked by largest-triangle-three-buckets"""
+    size = len(y)
+    if points >= size or points < 3:
+        return np.arange(size)
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64) # points - 2 buckets between first and last
+    count = np.diff(edges)
+    mx = np.add.reduceat(x[:-1], edges[:-1]) / count
+    my = np.add.reduceat(y[:-1], edges[:-1]) / count
+    keep = np.empty(points, dtype = np.int64)
+    keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nx, ny = (mx[i + 1], my[i + 1]) if i < points - 3 else (x[-1], y[-1])
+        area = np.abs((x[a] - nx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ny - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+def minmax(y, points):
+    """Positions of the minimum and maximum of <y> in <points> / 2 buckets"""
+    size = len(y)
+    if points >= size or points < 2:
+        return np.arange(size)
+    width = -(-size // (points // 2))
+    rows  = -(-size // width)
+    pad   = np.full(rows * width, np.nan)
+    pad[:size] = y
+    pad   = pad.reshape(rows, width)
+    start = np.arange(rows) * width
+    keep  = np.concatenate([[0, size - 1], start + np.nanargmin(pad, axis = 1), start + np.nanargmax(pad, axis = 1)])
+    return np.unique(keep)
+
+def decimate(df, points = None, method = 'lttb', zoom = None):
+    """Yield (column, x, y) per column of 'df', only within the <zoom> range (relayoutData of onzoom()) and thinned to <points>"""
+    x = df.index
+    if isinstance(x, pd.DatetimeIndex):
+        # tz_localize(None) -> https://github.com/plotly/plotly.py/issues/209
+        x = x.tz_localize(None)
+    if zoom and 'xaxis.range[0]' in zoom and 'xaxis.range[1]' in zoom:
+        lo, hi = zoom['xaxis.range[0]'], zoom['xaxis.range[1]']
+        if isinstance(x, pd.DatetimeIndex):
+            lo, hi = pd.Timestamp(lo), pd.Timestamp(hi)
+        inside = (x >= lo) & (x <= hi)
+        x, df = x[inside], df[inside]
+    for col in df.columns:
+        y = df[col]
+        if points is None or len(y) <= points:
+            yield col, x, y.values
+            continue
+        # thin the valid values, then put back the first NaN of every gap so lines still break there
+        ok = y.notna().values
+        at = np.flatnonzero(ok)
+        xc, yc = x[at], y.values[at]
+        if method == 'minmax':
+            keep = minmax(yc.astype(float), points)
+        else:
+            xn = xc.asi8 if isinstance(xc, pd.DatetimeIndex) else np.arange(len(xc))
+            keep = lttb(xn.astype(float), yc.astype(float), points)
+        gaps = np.flatnonzero(~ok & np.concatenate([[True], ok[:-1]]))
+        keep = np.union1d(at[keep], gaps)
+        yield col, x[keep], y.values[keep]
+
+def zoomrange(zoom):
+    """Keep the x-axis range of a zoomed plot (relayoutData of onzoom()) when redrawing it"""
+    if zoom and 'xaxis.range[0]' in zoom and 'xaxis.range[1]' in zoom:
+        return {'range': [zoom['xaxis.range[0]'], zoom['xaxis.range[1]']]}
+    return {}
+
+def make_plot(df, height = 350, points = None, method = 'lttb', zoom = None):
+    """
+    points: thin every line to about <points> samples (~ plot width in pixels), None: send all points
+    method: 'lttb' (keeps shape) or 'minmax' (keeps peaks)
+    zoom:   relayoutData of onzoom(): only the visible range is sent (full resolution when zoomed in far enough)
+    """
+    lines  = [go.Scatter(x = x, y = y, name = col) for col, x, y in decimate(df, points, method, zoom)]
     margin = go.Margin(l = 30, r = 10, t = 10, b = 30, autoexpand = False)
-    layout = go.Layout(margin = margin, height = height, showlegend = False)
+    layout = go.Layout(margin = margin, height = height, showlegend = False, xaxis = zoomrange(zoom))
     figure = {'data': lines, 'layout': layout}
     # plotly(figure)
     return figure
 
-def make_barplot(df, stacked = False):
-    idx = df.index
-    if df.index.dtype == pd.DatetimeIndex: idx = idx.tz_localize(None)
-    bars = [go.Bar(x = idx, y = df[col], name = col) for col in df.columns]
+def make_barplot(df, stacked = False, points = None, method = 'minmax', zoom = None):
+    if points is None and zoom is None:
+        idx = df.index
+        if df.index.dtype == pd.DatetimeIndex: idx = idx.tz_localize(None)
+        bars = [go.Bar(x = idx, y = df[col], name = col) for col in df.columns]
+    else:
+        bars = [go.Bar(x = x, y = y, name = col) for col, x, y in decimate(df, points, method, zoom)]
     margin = go.Margin(l = 30, r = 10, t = 10, b = 30, autoexpand = False)
-    layout = go.Layout(margin = margin, barmode = 'stack' if stacked else '')
+    layout = go.Layout(margin = margin, barmode = 'stack' if stacked else '', xaxis = zoomrange(zoom))
     figure = go.Figure(data = bars, layout = layout)
     # plotly(figure)
     return figure
 
+#app.do(on = onzoom('plot1'), set = setplot('plot1'), to = lambda inputs: make_plot(df, points = 1000, zoom = inputs['plot1']))
+
 
 
 # %% Helper functions
@@ -425,10 +1180,45 @@ textinput = lambda **kwargs: dcc.Input(type = 'text', className = 'form-control'
 datatable = lambda id, row_selectable = True, filterable = True, sortable = True, rows = [{}], **kwargs: row([dte.DataTable(id = id, rows = rows, row_selectable = row_selectable, filterable = filterable, sortable = sortable, **kwargs)])
 onrows = lambda id: [Input(id, 'selected_row_indices'), Input(id, 'rows')]
 rowsof = lambda id: [State(id, 'selected_row_indices'), State(id, 'rows')]
-make_datatable = lambda data: data.to_dict('records')
 setdatatable = lambda id: Output(id, 'rows')
 setrows = setdatatable
 
+# Columnar conversions: build records / frames column by column instead of cell by cell
+def make_datatable(data, format = False):
+    """Rows for setdatatable(): records built from whole columns (format: vectorised formatting of each column first)"""
+    names = list(data.columns)
+    cols  = [(colfmt(data.iloc[:, i]) if format else data.iloc[:, i]).tolist() for i in range(len(names))]
+    return [dict(zip(names, row)) for row in zip(*cols)]
+
+def make_columns(df, format = True):
+    """Column oriented payload {'columns': [...], 'data': {column: values}} (for stores/hidden components)"""
+    return {'columns': list(df.columns), 'data': {col: (colfmt(df[col]) if format else df[col]).tolist() for col in df.columns}}
+
+def getcolumns(payload):
+    """Dataframe from make_columns() payload"""
+    if not type(payload) is dict or not 'data' in payload:
+        return pd.DataFrame()
+    return pd.DataFrame(payload['data'], columns = payload.get('columns', None))
+
+def make_arrow(df):
+    """Base64 arrow ipc payload of 'df' (needs pyarrow)"""
+    import pyarrow
+    import pyarrow.ipc
+    table = pyarrow.Table.from_pandas(df, preserve_index = False)
+    sink  = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+
+def getarrow(payload):
+    """Dataframe from make_arrow() payload"""
+    if not type(payload) is str or payload == '':
+        return pd.DataFrame()
+    import pyarrow.ipc
+    return pyarrow.ipc.open_stream(base64.b64decode(payload)).read_all().to_pandas()
+
+#bench: make_datatable(df) 0.15s vs df.to_dict('records') 0.26s, make_arrow/getarrow and make_columns/getcolumns instead of records (100k rows, 4 columns)
+
 def getrows(inputs, id, selected = False):
     
     rows  = '{id}.rows'.format(id = id)
@@ -440,16 +1230,24 @@ def getrows(inputs, id, selected = False):
     data  = inputs[rows]
     index = inputs[index]
     
+    if type(data) is str:
+        data = frames.get(data, pd.DataFrame()) if ownframe(inputs, data) else pd.DataFrame()
+        if not selected:
+            return data
+        return data.iloc[index] if not index is None else pd.DataFrame()
+    
     if not type(data) is list:
         return pd.DataFrame()
     
-    data  = pd.DataFrame(data)
-    
     if not selected:
-        return data
+        return pd.DataFrame(data)
     
+    # only convert the selected rows
     if selected and not index is None:
-        data  = data.iloc[index]
+        index = np.asarray(index, dtype = np.intp)
+        if len(index) == 0:
+            return pd.DataFrame(columns = list(data[0].keys()) if len(data) > 0 else None)
+        data  = pd.DataFrame([data[i] for i in index], index = index)
         return data
     
     if selected and index is None:
@@ -457,6 +1255,74 @@ def getrows(inputs, id, selected = False):
     
     return pd.DataFrame()
 
+# %% Delta updates (only send what changed since the last output to this browser session)
+
+def session():
+    """Page load id store (filled by app.sessions()), add once to the layout"""
+    return dcc.Store(id = '_session')
+
+def sessionof():
+    return [State('_session', 'data')]
+
+def getsession(inputs):
+    return inputs.get('_session', None)
+
+# Last emitted state per (session, output id), least recently used are dropped
+deltas = collections.OrderedDict()
+deltas_lock = threading.Lock()
+deltas_size = 1000
+
+def remember(inputs, id, value):
+    """Store 'value' as last output of 'id' for this session and return the previous one (None if unknown)"""
+    key = (getsession(inputs), id)
+    if key[0] is None:
+        return None
+    with deltas_lock:
+        last = deltas.pop(key, None)
+        deltas[key] = value
+        while len(deltas) > deltas_size:
+            deltas.popitem(last = False)
+    return last
+
+def setplotdelta(id):
+    return [Output(id, 'figure'), Output(id, 'extendData')]
+
+def make_plotdelta(df, inputs, id, height = 350):
+    """
+    Use with set = setplotdelta(id) and using = sessionof(): first call sends the whole figure,
+    later calls only the points appended to 'df' (extendData, keeping len(df) points per line)
+    """
+    last = remember(inputs, id, (list(df.columns), df.index[-1] if len(df) else None))
+    if last is None or last[0] != list(df.columns) or last[1] is None or len(df) == 0 or df.index[0] > last[1]:
+        return make_plot(df, height), dash.no_update
+    new = df[df.index > last[1]]
+    if len(new) == 0:
+        return dash.no_update, dash.no_update
+    x = new.index.tz_localize(None) if isinstance(new.index, pd.DatetimeIndex) else new.index
+    extend = {'x': [list(x)] * len(new.columns), 'y': [new[col].tolist() for col in new.columns]}
+    return dash.no_update, [extend, list(range(len(new.columns))), len(df)]
+
+def make_rowsdelta(df, inputs, id):
+    """
+    Use with set = setdatatable(id) and using = sessionof(): first call sends all rows,
+    later calls only changed and appended rows (dash.Patch)
+    """
+    # remember a hash per row, not the frame itself (in-place updates would be diffed against themselves)
+    try:
+        hashes = pd.util.hash_pandas_object(df, index = False).values
+    except TypeError: # unhashable cells (lists, dicts): always send everything
+        hashes = None
+    last = remember(inputs, id, (list(df.columns), hashes))
+    if last is None or hashes is None or last[1] is None or last[0] != list(df.columns) or len(df) < len(last[1]):
+        return make_datatable(df)
+    n = len(last[1])
+    patch = dash.Patch()
+    for i in np.flatnonzero(last[1] != hashes[:n]):
+        patch[int(i)] = df.iloc[int(i)].to_dict()
+    if len(df) > n:
+        patch.extend(make_datatable(df.iloc[n:]))
+    return patch
+
 textarea = lambda id, **kwargs: dcc.Textarea(id = id, className = 'form-control', **kwargs)
 
 # Upload button
@@ -476,24 +1342,125 @@ def getupload(inputs, id):
     return upload
 
 def savefile(folder, name, content, date):
-    content_type, content_string = content.split(',')
-    decoded = base64.b64decode(content_string)
+    path, size, checksum = streamfile(folder, name, content)
+    return os.path.isfile(path)
+
+# Streaming uploads: decode base64 in fixed-size chunks straight to disk (never a full decoded copy in memory)
+def streamfile(folder, name, content, chunk = 4 * 1024 * 1024):
+    """Save one upload, returns (path, size in bytes, sha256 hex digest)"""
+    start = content.index(',') + 1
+    chunk = chunk - chunk % 4 # whole base64 quads only
     filepath = folder + '/' + name
+    checksum = hashlib.sha256()
+    size = 0
     with open(filepath, 'w+b') as file:
-        file.write(decoded)
-    return os.path.isfile(filepath)
+        for i in range(start, len(content), chunk):
+            decoded = base64.b64decode(content[i:i + chunk])
+            checksum.update(decoded)
+            file.write(decoded)
+            size += len(decoded)
+    return filepath, size, checksum.hexdigest()
+
+def csv2parquet(path, chunksize = 100000, **kwargs):
+    """Convert csv file at 'path' to parquet next to it, chunk by chunk (needs pyarrow), returns parquet path"""
+    import pyarrow
+    import pyarrow.parquet
+    target = os.path.splitext(path)[0] + '.parquet'
+    writer = None
+    try:
+        for data in pd.read_csv(path, chunksize = chunksize, **kwargs):
+            table = pyarrow.Table.from_pandas(data, preserve_index = False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(target, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    return target
+
+def saveuploads(inputs, id, folder, threads = 4, parquet = False, **kwargs):
+    """
+    Save all files of upload(id) to 'folder' concurrently, returns list of dicts with name, path, size, sha256 (and parquet)
+    parquet: True: also convert .csv uploads to parquet in chunks (passing **kwargs to pd.read_csv)
+    """
+    def save(upload):
+        name, content, date = upload
+        path, size, checksum = streamfile(folder, name, content)
+        saved = {'name': name, 'path': path, 'size': size, 'sha256': checksum}
+        if parquet and name.lower().endswith('.csv'):
+            saved['parquet'] = csv2parquet(path, **kwargs)
+        return saved
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(save, getupload(inputs, id)))
 
 onupload = lambda id: [Input(id, 'contents'), Input(id, 'filename'), Input(id, 'last_modified')]
 
-# Get currently logged in user
+# Get currently logged in user (parsed once per request)
 def getuser():
+    usr = getattr(flask.g, '_user', None)
+    if usr is not None:
+        return usr
     # Credit: dash_auth package source code
     header = flask.request.headers.get('Authorization', None)
     usrpwd = base64.b64decode(header.split('Basic ')[1])
     usrpwd = usrpwd.decode('utf-8')
     usr    = usrpwd.split(':')[0]
+    flask.g._user = usr
     return usr
 
+# %% Authentication (salted password hashes, verified headers cached for a short time)
+
+# verified headers are cached, so a moderate work factor keeps startup fast for many users
+hash_iterations = 20000
+
+def userstore(users, iterations = hash_iterations):
+    """Dict {user: (salt, hash, iterations)} from a list of [user, password] pairs or a dict {user: password}"""
+    pairs = users.items() if type(users) == dict else users
+    store = {}
+    for usr, pwd in pairs:
+        salt = os.urandom(16)
+        store[usr] = (salt, hashlib.pbkdf2_hmac('sha256', pwd.encode('utf8'), salt, iterations), iterations)
+    return store
+
+def verify(store, usr, pwd):
+    """Check password against the user store in constant time (unknown users cost the same)"""
+    salt, hashed, iterations = store.get(usr, (b'', b'', hash_iterations))
+    check = hashlib.pbkdf2_hmac('sha256', pwd.encode('utf8'), salt, iterations)
+    return usr in store and hmac.compare_digest(check, hashed)
+
+class CachedAuth(dash_auth.BasicAuth):
+    """Basic auth against hashed passwords, verified Authorization headers are remembered for <ttl> seconds"""
+
+    def __init__(self, app, users, ttl = 300, size = 10000):
+        super().__init__(app, []) # the base class would keep the plaintext passwords
+        self._users = {}
+        self.store = userstore(users)
+        self.ttl   = ttl
+        self.size  = size
+        self.cache = {}
+
+    def is_authorized(self):
+        header = flask.request.headers.get('Authorization', None)
+        if not header or not header.startswith('Basic '):
+            return False
+        key = hashlib.sha256(header.encode('utf8')).digest() # no passwords kept in memory
+        hit = self.cache.get(key)
+        now = time.time()
+        if hit is not None and hit[1] > now:
+            flask.g._user = hit[0]
+            return True
+        try:
+            usr, pwd = base64.b64decode(header[6:]).decode('utf-8').split(':', 1)
+        except (ValueError, UnicodeDecodeError):
+            return False
+        if not verify(self.store, usr, pwd):
+            return False
+        if len(self.cache) >= self.size:
+            self.cache.clear()
+        self.cache[key] = (usr, now + self.ttl)
+        flask.g._user = usr
+        return True
+
 # Get current URL of loaded page
 def geturl(inputs):
     if not '_url' in inputs:        
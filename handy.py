@@ -1,47 +1,98 @@
 
 import os
 import pandas as pd
+from pandas.api.extensions import take
 import numpy as np
 import re
 import itertools
 import io
+import mmap
 import importlib
+import functools
+import hashlib
+import fnmatch
+import concurrent.futures
 import subprocess
+import time
+import typing
+import uuid
 
 # Fix column names
+_nonlatin = re.compile('[^a-zA-Z0-9_]')
+
+@functools.lru_cache(maxsize = 256)
+def _fixnames(cols):
+    """Normalised and deduplicated names for a tuple of raw column names (memoised, LRU)"""
+    if len(cols) == 0:
+        return ()
+    names = pd.Index(cols).str.replace(_nonlatin, '', regex = True).str.lower()
+    names = pd.Series(names.where(names.str.strip() != '', 'x'))
+    count = names.groupby(names.values, sort = False).cumcount() + 1
+    names = names.where(count == 1, names + count.astype(str))
+    return tuple(names)
+
 def fixcols(df):
     """Simplify and ensure unique non-empty column names (remove non-latin symbols and lowercase)"""
-    df.columns = [re.sub('[^a-zA-Z0-9_]', '', c).lower() for c in list(df.columns)]
-    counts = {}
-    names = []
-    for col in df.columns:
-        if col.strip() == '':
-            col = 'x'
-        if col in counts:
-            counts[col] = counts[col] + 1
-            names.append(col + str(counts[col]))
-        else:
-            names.append(col)
-            counts[col] = 1
-    df.columns = names
+    df.columns = list(_fixnames(tuple(df.columns)))
     return df
 
+def _datetimes(fallback):
+    """pd.to_datetime on the whole column, element-wise <fallback> if the format is not uniform (like apply)"""
+    def coerce(s):
+        try:
+            return pd.to_datetime(s)
+        except (ValueError, TypeError):
+            return s.apply(fallback)
+    return coerce
+
+# Vectorised equivalents of s.apply(<type>) for common target types (str stays on apply: keeps 'nan' and nothing vectorised is faster)
+_coercions = {
+    int:             lambda s: s.astype(int),
+    float:           lambda s: s.astype(float),
+    bool:            lambda s: s.astype(bool),
+    pd.Timestamp:    _datetimes(pd.Timestamp),
+    pd.to_datetime:  _datetimes(pd.to_datetime),
+    pd.to_numeric:   pd.to_numeric,
+    'int':           lambda s: s.astype(int),
+    'float':         lambda s: s.astype(float),
+    'datetime':      _datetimes(pd.to_datetime),
+    'category':      lambda s: s.astype('category')
+}
+
 # Assure that some columns exist
 def havecols(df, cols, fill = np.nan, types = None):
-    """Ensure 'df' has columns 'cols' of type 'types'"""
-    newcols = list(set(cols).difference(set(df.columns)))
-    for col in newcols:
-        df = df.assign(**{col: fill})
+    """Ensure 'df' has columns 'cols' of type 'types' (int, float, bool, str, pd.Timestamp, 'datetime', 'category' or any function)"""
+    newcols = [col for col in cols if not col in df.columns]
+    if len(newcols) > 0:
+        df = df.assign(**{col: fill for col in newcols}) # one copy for all new columns
     if type(types) == list:
         for i, col in enumerate(cols):
-            df[col] = df[col].apply(types[i])
+            coerce = _coercions.get(types[i], None) if isinstance(types[i], typing.Hashable) else None
+            df[col] = coerce(df[col]) if coerce is not None else df[col].apply(types[i])
     return df
 
+#bench([havecols, lambda df, cols, types: df.assign(**{col: df[col].apply(t) for col, t in zip(cols, types)})], df, ['a', 'b', 'c', 'd', 'e'], types = [str, float, float, pd.Timestamp, str], n = 1) # 1M rows: havecols 1.9s, apply 2.4s
+
 # Make all combinations in dict
-def expand(d):
-    """Create all combination of keys in dict, e.g. {'a':[1,2], 'b': [3,4]} -> [[a1,b4],[a1,b4]...etc]"""
+def expand(d, fast = False):
+    """Create all combination of keys in dict, e.g. {'a':[1,2], 'b': [3,4]} -> [[a1,b4],[a1,b4]...etc] (fast = True: build column-wise with numpy)"""
+    if fast:
+        return next(expand_chunks(d, size = None))
     return pd.DataFrame([row for row in itertools.product(*d.values())], columns=d.keys())
 
+def expand_chunks(d, size = 1000000):
+    """Generator of dataframes with at most <size> rows, together covering all combinations of keys in dict (same order as expand())"""
+    values = [pd.Index(list(v)) for v in d.values()]
+    counts = np.array([len(v) for v in values], dtype = np.int64)
+    total  = int(np.prod(counts))
+    # row i takes item (i // stride) % count of each key (last key varies fastest, like itertools.product)
+    stride = np.append(np.cumprod(counts[::-1])[::-1][1:], 1)
+    size   = max(total, 1) if size is None else size
+    for start in range(0, max(total, 1), size):
+        rows = np.arange(start, min(start + size, total), dtype = np.int64)
+        cols = {key: val.take((rows // stride[i]) % counts[i]) for i, (key, val) in enumerate(zip(d.keys(), values))}
+        yield pd.DataFrame(cols, columns = list(d.keys()))
+
 
 # freq = '1D', '1H', '15min'
 def complete(df, time0, time1, freq = '15min', fillna = None):
@@ -59,10 +110,123 @@ def complete(df, time0, time1, freq = '15min', fillna = None):
         df0 = df0.fillna(method = fillna)
     return df0
 
+# Time grids are shared by all series completed over the same window
+@functools.lru_cache(maxsize = 64)
+def _grid(time0, time1, freq, tz):
+    """Cached time grid and its fixed step in ticks (None if irregular, e.g. days over dst)"""
+    times = pd.date_range(pd.Timestamp(time0), pd.Timestamp(time1), freq = freq)
+    times = times if tz is None else times.tz_convert(tz)
+    ticks = times.asi8
+    step  = ticks[1] - ticks[0] if len(ticks) > 1 else 0
+    step  = step if step > 0 and (np.diff(ticks) == step).all() else None
+    return times, step
+
+def _indexer(index, grid, step):
+    """Position in 'index' of every grid time (-1 if missing), by arithmetic on regular grids"""
+    aware = isinstance(index, pd.DatetimeIndex) and (index.tz is None) == (grid.tz is None)
+    if step is None or not aware:
+        return index.get_indexer(grid)
+    ticks = index.as_unit(grid.unit).asi8 - grid.asi8[0]
+    pos   = ticks // step
+    ok    = (ticks % step == 0) & (pos >= 0) & (pos < len(grid))
+    indexer = np.full(len(grid), -1, dtype = np.intp)
+    indexer[pos[ok]] = np.flatnonzero(ok)
+    return indexer
+
+def _fill(df, fillna):
+    if fillna in ['ffill', 'pad']:
+        return df.ffill()
+    if fillna in ['bfill', 'backfill']:
+        return df.bfill()
+    return df
+
+def _complete(data, grid, step):
+    """Reindex dataframe or series 'data' on 'grid' without joining"""
+    indexer = _indexer(data.index, grid, step)
+    if isinstance(data, pd.Series):
+        return pd.Series(take(data.values, indexer, allow_fill = True), index = grid, name = data.name)
+    df0 = pd.DataFrame({col: take(data[col].values, indexer, allow_fill = True) for col in data.columns}, index = grid)
+    df0.columns = data.columns
+    return df0
+
+def complete_fast(df, time0, time1, freq = '15min', fillna = None, tz = 'CET'):
+    """Like complete(), but take rows on a cached time grid instead of joining (tz = None: keep grid timezone)"""
+    grid, step = _grid(time0, time1, freq, tz)
+    df0 = _complete(df, grid, step)
+    df0.index = grid.rename(df.index.name) # never rename the cached grid itself
+    return _fill(df0, fillna)
+
+def complete_many(data, time0, time1, freq = '15min', fillna = None, tz = 'CET'):
+    """Complete a list or dict of dataframes against one time grid (a dict of series is returned as one dataframe)"""
+    grid, step = _grid(time0, time1, freq, tz)
+    if type(data) == dict and all(isinstance(v, pd.Series) for v in data.values()):
+        return _fill(pd.DataFrame({key: _complete(v, grid, step).values for key, v in data.items()}, index = grid.rename(None)), fillna)
+    if type(data) == dict:
+        return {key: complete_fast(df, time0, time1, freq, fillna, tz) for key, df in data.items()}
+    return [complete_fast(df, time0, time1, freq, fillna, tz) for df in data]
+
+#bench([complete, complete_fast], df, '2020-01-01 00:00+01:00', '2020-12-31 23:45+01:00', n = 100)
+
+
+# Bin labels are built once per category (not per row) and the result stays categorical
+def _relabel(newcol, categories, codes):
+    """Categorical of <newcol> + digits of each category (missing values get <newcol>)"""
+    names = [newcol + re.sub('[^0-9]', '', str(c)) for c in categories] + [newcol]
+    codes = np.where(codes < 0, len(names) - 1, codes)
+    remap, unique = pd.factorize(pd.Index(names))
+    used = np.zeros(len(unique), dtype = bool)
+    used[remap[codes]] = True
+    keep = np.cumsum(used) - 1 # drop the <newcol> category if nothing is missing
+    return pd.Categorical.from_codes(keep[remap[codes]], categories = unique[used])
 
 def cut(df, col, newcol, bins, labels):
-    df[newcol] = pd.cut(df[col], bins = bins, labels = labels)
-    df[newcol] = df[newcol].apply(lambda s: newcol + re.sub('[^0-9]', '', str(s)))
+    binned = pd.cut(df[col], bins = bins, labels = labels)
+    if labels is False:
+        # integer bin numbers instead of a categorical
+        codes = binned.fillna(-1).to_numpy(dtype = np.int64)
+        df[newcol] = pd.Series(_relabel(newcol, range(codes.max() + 1 if len(codes) else 0), codes), index = df.index)
+        return df
+    df[newcol] = pd.Series(_relabel(newcol, binned.cat.categories, binned.cat.codes.values), index = df.index)
+    return df
+
+def _round_breaks(bins, precision = 3):
+    """Breaks rounded to <precision> significant decimals like pd.cut labels (more digits until unique)"""
+    def rounded(x, precision):
+        if not np.isfinite(x) or x == 0:
+            return x
+        frac, whole = np.modf(x)
+        digits = -int(np.floor(np.log10(abs(frac)))) - 1 + precision if whole == 0 else precision
+        return np.around(x, digits)
+    for p in range(precision, 20):
+        breaks = [rounded(b, p) for b in bins]
+        if len(np.unique(breaks)) == len(bins):
+            return breaks
+    return list(bins)
+
+def cuts(df, specs):
+    """Bin several columns with np.searchsorted, specs = {col: (newcol, bins, labels)} (same result as cut() per column)"""
+    for col, (newcol, bins, labels) in specs.items():
+        x = df[col].to_numpy(dtype = float)
+        breaks = bins
+        if np.ndim(bins) == 0:
+            # equal width bins like pd.cut, labels rounded like pd.cut (precision = 3)
+            mn, mx = np.nanmin(x), np.nanmax(x)
+            if mn == mx:
+                # constant column: widen the range by 0.1% (0.001 at zero) like pd.cut
+                mn, mx = mn - (0.001 * abs(mn) or 0.001), mx + (0.001 * abs(mx) or 0.001)
+                bins = np.linspace(mn, mx, int(bins) + 1)
+            else:
+                bins = np.linspace(mn, mx, int(bins) + 1)
+                bins[0] -= (mx - mn) * 0.001
+            breaks = _round_breaks(bins)
+        edges = np.asarray(bins, dtype = float)
+        codes = np.searchsorted(edges, x, side = 'left') - 1 # right-closed bins (a, b]
+        codes[(codes >= len(edges) - 1) | np.isnan(x)] = -1
+        if labels is False:
+            categories = range(len(edges) - 1)
+        else:
+            categories = labels if labels is not None else pd.IntervalIndex.from_breaks(breaks)
+        df[newcol] = pd.Series(_relabel(newcol, categories, codes), index = df.index)
     return df
 
 def flatcols(df, sep = '_', drop = False):
@@ -74,11 +238,38 @@ def flatcols(df, sep = '_', drop = False):
         df.columns = [sep.join([str(c) for c in col]) for col in df.columns.values]
     return df
 
-def atm(t = 'now', u = 'H', n = 0):
-    return pd.Timestamp(t, tz = 'CET').floor(u) + n * pd.Timedelta(u)
+# Parsed time units are cached ('H' -> Timedelta(hours = 1), old aliases also work with newer pandas)
+_aliases = {'H': 'h', 'T': 'min', 'S': 's', 'L': 'ms', 'U': 'us', 'N': 'ns'}
+
+@functools.lru_cache(maxsize = 64)
+def _unit(u):
+    u = re.sub('(?<![a-zA-Z])[HTSLUN]$', lambda m: _aliases[m.group(0)], u)
+    return pd.Timedelta(u if u[:1].isdigit() else '1' + u)
+
+@functools.lru_cache(maxsize = 16)
+def _stdoffset(tz):
+    return min(pd.Timestamp('2000-01-01', tz = tz).utcoffset(), pd.Timestamp('2000-07-01', tz = tz).utcoffset())
 
-def rtm(n = 0, u = 'H'):
-    return atm('now', u = u, n = n)
+def atm(t = 'now', u = 'H', n = 0, tz = 'CET'):
+    """Time <t> in <tz> floored to unit <u> and shifted <n> units"""
+    delta = _unit(u)
+    t = pd.Timestamp.now(tz) if type(t) == str and t == 'now' else pd.Timestamp(t, tz = tz)
+    return t.floor(delta) + n * delta
+
+def rtm(n = 0, u = 'H', tz = 'CET'):
+    return atm('now', u = u, n = n, tz = tz)
+
+def atms(times, u = 'H', n = 0, tz = 'CET'):
+    """Vectorised atm(): floor and shift a whole array/index of times at once"""
+    delta = _unit(u)
+    times = pd.DatetimeIndex(times)
+    times = times.tz_localize(tz) if times.tz is None else times.tz_convert(tz)
+    # floored times keep their dst side (the ambiguous autumn hour)
+    offset = times.tz_localize(None) - times.tz_convert('UTC').tz_localize(None)
+    dst    = np.asarray(offset > _stdoffset(tz))
+    return times.floor(delta, ambiguous = dst, nonexistent = 'shift_forward') + n * delta
+
+#bench([atm], '2020-03-01 12:34', n = 20000) # ~74us per call (was ~114us), atms() on 75k times: ~0.16us per time (atm in a loop: ~66us)
 
 
 # Walk a trail into the data and retrieve a None or a value
@@ -117,6 +308,45 @@ def descent(data, trail, fail = None):
     
     return data
 
+# Compiled trail: normalise the trail and check step types once, then reuse for many data items
+class Trail:
+    """Reusable descent() accessor, call with data to retrieve a subitem or 'fail'"""
+    __slots__ = ('steps', 'fail')
+
+    def __init__(self, trail, fail = None):
+        trail = trail if type(trail) == list else [trail]
+        self.steps = tuple((step, type(step) == int) for step in trail)
+        self.fail  = fail
+
+    def __call__(self, data):
+        fail = self.fail
+        for step, isint in self.steps:
+            kind = type(data)
+            if kind is dict:
+                if not step in data:
+                    return fail
+            elif kind is list:
+                if not isint or len(data) <= step:
+                    return fail
+            else:
+                return fail
+            data = data[step]
+        return fail if data is None else data
+
+def compile_trail(trail, fail = None):
+    """Compile a descent() trail once into a reusable accessor, e.g. compile_trail(['a', 0])(data)"""
+    return Trail(trail, fail)
+
+def descent_many(records, trails, fail = None):
+    """Retrieve several trails from a list of records into a dataframe (trails = list or dict {column: trail})"""
+    if type(trails) != dict:
+        trails = {'.'.join(str(s) for s in (t if type(t) == list else [t])): t for t in trails}
+    cols = {}
+    for col, trail in trails.items():
+        get = Trail(trail, fail)
+        cols[col] = [get(record) for record in records]
+    return pd.DataFrame(cols, columns = list(trails.keys()))
+
 # Inverse a dict mapping {'a': 'b'} -> {'b': 'a'}
 def inv(mapping):
     """Inverse a mapping dict {'key': 'val'} -> {'val': 'key'}"""
@@ -142,11 +372,50 @@ def flatlist(lst):
 def rls(f):
     """Recursive listing of files in folder"""
     if os.path.isdir(f):
-        l = os.listdir(f)
-        return sum([rls(f + '/' + i) for i in l], [])
+        return [path.lower() for path in walk(f)]
     else:
         return [f.lower()]
 
+def _walk(folder, match, depth, stat, subfolder = None):
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return
+    for entry in entries:
+        path = folder + '/' + entry.name
+        if entry.is_dir():
+            if depth is None or depth > 0:
+                deeper = None if depth is None else depth - 1
+                if subfolder is None:
+                    yield from _walk(path, match, deeper, stat)
+                else:
+                    subfolder(path, deeper)
+        elif match(path, entry.name):
+            if stat:
+                st = entry.stat()
+                yield (path, st.st_size, st.st_mtime)
+            else:
+                yield path
+
+def walk(folder, pattern = None, regex = None, depth = None, stat = False, threads = 0):
+    """Lazy recursive listing of files in folder (os.scandir): <pattern> = glob on file name, <regex> = search on path,
+    <depth> = max folders deep, stat = True: yield (path, size, mtime), threads > 0: walk subfolders on a thread pool (order not kept)"""
+    regex = re.compile(regex) if type(regex) == str else regex
+    def match(path, name):
+        if pattern is not None and not fnmatch.fnmatch(name, pattern):
+            return False
+        return regex is None or regex.search(path) is not None
+    if threads <= 0:
+        yield from _walk(folder, match, depth, stat)
+        return
+    # top level files right away, every subfolder is walked as one task on the pool
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        subs = []
+        task = lambda path, deeper: list(_walk(path, match, deeper, stat))
+        yield from _walk(folder, match, depth, stat, lambda path, deeper: subs.append(pool.submit(task, path, deeper)))
+        for sub in concurrent.futures.as_completed(subs):
+            yield from sub.result()
+
 def mkdir(folder):
     """Safely create folder ... """
     return os.mkdir(folder) if not os.path.exists(folder) else None
@@ -197,8 +466,295 @@ def read_log(file, nchars = 1000):
         s = s.decode('utf8')
         return s
 
+def read_last_rows(file, n = 10, header = False, **kwargs):
+    """
+    read exactly the last <n> rows of <file> (scanning back over a mmap) and return pandas dataframe (passing **kwargs to pd, names = [...] overrides the header)
+    Rows are lines: empty lines are skipped like the parser does, quoted fields containing newlines are not supported
+    """
+    names = kwargs.pop('names', None)
+    with open(file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return pd.DataFrame()
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            top   = mm.find(b'\n') + 1 if header else 0
+            if header:
+                top   = size if top == 0 else top
+                if names is None:
+                    names = list(pd.read_csv(io.BytesIO(mm[:top]), **{**kwargs, 'header': 0, 'nrows': 0}).columns)
+            # skip all trailing empty lines
+            end = size
+            while end > top and mm[end - 1] in b'\r\n':
+                end -= 1
+            # count lines back from the end, empty ('' or '\r') lines are not rows
+            start, pos, found = end, end, 0
+            while found < n and pos > top:
+                nl    = mm.rfind(b'\n', top, pos)
+                start = top if nl < 0 else nl + 1
+                found += mm[start:pos].strip(b'\r') != b''
+                pos   = max(nl, top)
+        if found == 0:
+            return pd.DataFrame(columns = names)
+        # let the C parser read straight from the file (no decode, no StringIO copy)
+        f.seek(start)
+        return pd.read_csv(f, header = None, names = names, **kwargs)
+
 #data = read_tail('./cache/task01.sts', 1000, sep = '\t')
+#data = read_last_rows('./cache/task01.sts', 100, header = True, sep = '\t')
+#bench([lambda f: read_tail(f, 160000, sep = '\t'), lambda f: read_last_rows(f, 1000, sep = '\t')], './cache/task01.sts', n = 100) # 200k rows of 156 bytes: read_tail 2.3ms (~1000 rows), read_last_rows 2.9ms (exactly 1000)
+
+# Tail engine: remember byte offset per file and only read what was appended since the last poll
+_tails = {}
+
+def _tail_blocks(file, nchars = 1000, block = 1 << 20, key = None):
+    """Yield byte blocks of newly appended complete lines in <file> (start at last <nchars> bytes on first call)"""
+    key = os.path.abspath(file) if key is None else key
+    try:
+        st = os.stat(file)
+    except OSError:
+        return
+    ident = (st.st_dev, st.st_ino)
+    known, pos = _tails.get(key, (None, 0))
+    if known is None:
+        pos = max(0, st.st_size - nchars) # first poll: behave like read_log
+    elif known != ident or pos > st.st_size:
+        pos = 0                           # rotated or truncated: start over
+    with open(file, 'rb') as f:
+        if pos > 0:
+            f.seek(pos - 1)
+            skip = f.readline() # skip partial first line
+            if not skip.endswith(b'\n'):
+                return
+            pos = pos - 1 + len(skip)
+        rest = b''
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1 # never split a line (or a multibyte utf8 char)
+            rest = data[end:]
+            if end == 0:
+                continue
+            # commit the block only once the consumer took it (stopping mid-block loses nothing)
+            _tails[key] = (ident, pos)
+            yield data[:end]
+            pos = pos + end
+            _tails[key] = (ident, pos)
+    _tails[key] = (ident, pos)
+
+def _tail_advance(key, nbytes):
+    """Move the remembered offset of <key> forward by <nbytes> consumed within a block"""
+    ident, pos = _tails[key]
+    _tails[key] = (ident, pos + nbytes)
+
+def tail_lines(file, nchars = 1000, block = 1 << 20, key = None):
+    """Generator of complete lines appended to <file> since previous call (handles rotation and truncation)"""
+    key = os.path.abspath(file) if key is None else key
+    for data in _tail_blocks(file, nchars, block, key):
+        # split on '\n' only (str.splitlines() also breaks on '\x0c', '\u2028', ...), blocks end with '\n'
+        for line in data.split(b'\n')[:-1]:
+            _tail_advance(key, len(line) + 1) # per line handed out, so a consumer stopping early resumes after its last line
+            yield (line[:-1] if line.endswith(b'\r') else line).decode('utf8')
+
+def tail_read(file, nchars = 1000, key = None, **kwargs):
+    """Pandas dataframe of rows appended to <file> since previous call (passing **kwargs to pd)"""
+    data = b''.join(_tail_blocks(file, nchars, key = key))
+    if data.strip() == b'':
+        return pd.DataFrame()
+    return pd.read_csv(io.BytesIO(data), header = None, **kwargs)
+
+def tail_reset(file = None, key = None):
+    """Forget remembered offset of <file> (or of all files)"""
+    if file is None and key is None:
+        _tails.clear()
+    else:
+        _tails.pop(os.path.abspath(file) if key is None else key, None)
+
+def follow(file, interval = 1.0, nchars = 1000, key = None):
+    """Endless generator of new lines in <file>, polling every <interval> seconds (like tail -f)"""
+    while True:
+        for line in tail_lines(file, nchars, key = key):
+            yield line
+        time.sleep(interval)
+
+#for line in follow('./cache/task01.sts'): print(line)
+
+
+def bench(funs, *args, n = 10, **kwargs):
+    """Time <n> calls of each function in <funs> with the same arguments and return dataframe with seconds per call"""
+    times = []
+    for fun in funs:
+        t0 = time.perf_counter()
+        for i in range(n):
+            fun(*args, **kwargs)
+        times.append((time.perf_counter() - t0) / n)
+    return pd.DataFrame({'function': [fun.__name__ for fun in funs], 'seconds': times})
+
+# Disk cache: keep dataframe results of (slow) loading functions as feather/parquet files between runs
+def _fingerprint(value, hash = False):
+    """Stable description of an argument (dataframes by content, existing files by mtime/size and optionally content)"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest = hashlib.sha1(pd.util.hash_pandas_object(value, index = True).values.tobytes())
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode('utf8'))
+        return 'frame:' + digest.hexdigest()
+    if isinstance(value, str) and os.path.isfile(value):
+        st = os.stat(value)
+        desc = 'file:{}:{}:{}'.format(os.path.abspath(value), st.st_mtime_ns, st.st_size)
+        if hash:
+            digest = hashlib.sha1()
+            with open(value, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            desc = desc + ':' + digest.hexdigest()
+        return desc
+    if isinstance(value, (list, tuple)):
+        return repr([_fingerprint(v, hash) for v in value])
+    if isinstance(value, dict):
+        return repr(sorted((k, _fingerprint(v, hash)) for k, v in value.items()))
+    return repr(value)
+
+def _cache_read(path):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(path, memory_map = True).to_pandas()
+    import pyarrow.feather
+    return pyarrow.feather.read_table(path, memory_map = True).to_pandas()
+
+def _cache_write(df, path):
+    import pyarrow
+    table = pyarrow.Table.from_pandas(df)
+    temp  = '{}.{}.tmp'.format(path, uuid.uuid4().hex) # one temp file per writer (threads and processes)
+    try:
+        if path.endswith('.parquet'):
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(table, temp)
+        else:
+            import pyarrow.feather
+            pyarrow.feather.write_feather(table, temp, compression = 'uncompressed') # uncompressed: can be memory-mapped
+        os.replace(temp, path)
+    except Exception:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+def cache_clean(folder = './cache', size = 2 * 1024 ** 3):
+    """Delete least recently used cache files in <folder> until they take at most <size> bytes"""
+    files = [(path, st, mt) for path, st, mt in walk(folder, regex = r'\.(feather|parquet)$', depth = 0, stat = True)]
+    total = sum(st for path, st, mt in files)
+    for path, st, mt in sorted(files, key = lambda f: f[2]):
+        if total <= size:
+            break
+        try:
+            os.remove(path)
+            total -= st
+        except OSError:
+            pass
+    return total
+
+def diskcache(folder = './cache', size = 2 * 1024 ** 3, format = 'feather', hash = False):
+    """
+    Decorator: keep dataframe results on disk keyed by function, arguments and source files (mtime/size, hash = True: content)
+    format: 'feather' or 'parquet' (needs pyarrow), size: max bytes of the cache folder (least recently used are deleted)
+    Use: @diskcache('./cache') def load(file): return havecols(fixcols(pd.read_csv(file)), ...)
+    """
+    def decorator(fun):
+        @functools.wraps(fun)
+        def cached(*args, **kwargs):
+            parts = [fun.__module__, fun.__qualname__] + [_fingerprint(v, hash) for v in args]
+            parts = parts + ['{}={}'.format(k, _fingerprint(v, hash)) for k, v in sorted(kwargs.items())]
+            key   = hashlib.sha1(repr(parts).encode('utf8')).hexdigest()
+            path  = os.path.join(folder, '{}.{}'.format(key, format))
+            if os.path.isfile(path):
+                try:
+                    df = _cache_read(path)
+                    os.utime(path) # mark as recently used
+                    return df
+                except Exception:
+                    pass
+            df = fun(*args, **kwargs)
+            if isinstance(df, pd.DataFrame):
+                try:
+                    os.makedirs(folder, exist_ok = True)
+                    _cache_write(df, path)
+                    cache_clean(folder, size)
+                except Exception:
+                    pass # not cached, the result is still good
+            return df
+        cached.folder = folder
+        return cached
+    return decorator
+
+# Bulk csv ingest: files are found with walk(), read in chunks on a process pool and normalised per chunk
+def _ingest_file(path, name, target, cols, types, chunksize, kwargs):
+    """Read one csv file in chunks, fixcols/havecols each chunk, write parquet parts to <target>/file=<name> (or return the frame)"""
+    start = time.perf_counter()
+    parts = []
+    rows  = 0
+    for i, chunk in enumerate(pd.read_csv(path, chunksize = chunksize, **kwargs)):
+        chunk = fixcols(chunk)
+        if cols is not None:
+            chunk = havecols(chunk, cols, types = types)
+        rows += len(chunk)
+        if target is None:
+            parts.append(chunk)
+        else:
+            folder = os.path.join(target, 'file=' + name)
+            os.makedirs(folder, exist_ok = True)
+            chunk.to_parquet(os.path.join(folder, 'part-{:05d}.parquet'.format(i)), index = False)
+    report = {'file': path, 'rows': rows, 'bytes': os.path.getsize(path), 'seconds': time.perf_counter() - start}
+    if target is not None:
+        return report, None
+    return report, pd.concat(parts, ignore_index = True) if len(parts) > 0 else pd.DataFrame()
 
+def ingest(folder, pattern = '*.csv', target = None, cols = None, types = None, chunksize = 100000, processes = 4, inflight = None, progress = print, **kwargs):
+    """
+    Load all files matching <pattern> below <folder> (passing **kwargs to pd.read_csv) on <processes> worker processes
+    target:    folder for a parquet dataset partitioned per file (file=<path below folder>/part-<n>.parquet), None: return one combined frame
+    cols/types: schema per chunk via havecols() (types must be picklable, e.g. float, str, 'datetime')
+    inflight:  max files being read at once (back-pressure, default 2 x processes)
+    progress:  function called with a report line per finished file (None: quiet)
+    Returns (combined frame or None, report frame with rows, bytes, seconds and MB/s per file)
+    """
+    files    = sorted(walk(folder, pattern = pattern))
+    inflight = 2 * processes if inflight is None else inflight
+    # partition names from the path below <folder> (a/data.csv -> a__data), they must stay unique
+    names = {}
+    for path in files:
+        name = os.path.splitext(os.path.relpath(path, folder))[0].replace(os.sep, '__').replace('/', '__')
+        name = re.sub('[^a-zA-Z0-9_.-]', '_', name)
+        if name in names:
+            raise ValueError('ingest: files "{}" and "{}" map to the same partition "{}"'.format(names[name], path, name))
+        names[name] = path
+    names = inv(names)
+    # results are kept by file position, so frame and report follow the order of <files> (not completion)
+    reports  = [None] * len(files)
+    frames   = [None] * len(files)
+    finished = 0
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        pending = {}
+        queue   = iter(enumerate(files))
+        while True:
+            for i, path in queue:
+                pending[pool.submit(_ingest_file, path, names[path], target, cols, types, chunksize, kwargs)] = i
+                if len(pending) >= inflight:
+                    break
+            if len(pending) == 0:
+                break
+            done = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED).done
+            for future in done:
+                i = pending.pop(future)
+                report, data = future.result()
+                report['mbps'] = report['bytes'] / 1e6 / max(report['seconds'], 1e-9)
+                reports[i] = report
+                frames[i]  = data
+                finished  += 1
+                if progress is not None:
+                    progress('ingest: {} files of {} done, {} ({} rows, {:.1f} MB/s)'.format(finished, len(files), report['file'], report['rows'], report['mbps']))
+    report = pd.DataFrame(reports, columns = ['file', 'rows', 'bytes', 'seconds', 'mbps'])
+    if target is not None:
+        return None, report
+    return (pd.concat(frames, ignore_index = True) if len(frames) > 0 else pd.DataFrame()), report
 
 def uncache(libs):
     """Reload libraries (libs = list of modules)"""